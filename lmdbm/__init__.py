@@ -1,7 +1,8 @@
 """Python DBM style wrapper around LMDB (Lightning Memory-Mapped Database)"""
 
-from .lmdbm import Lmdb, LmdbGzip, error, open
+from .cache import cached
+from .lmdbm import Lmdb, LmdbGzip, LmdbMulti, error, open
 
 __version__ = "0.0.6"
 
-__all__ = ["Lmdb", "LmdbGzip", "error", "open", "__version__"]
+__all__ = ["Lmdb", "LmdbGzip", "LmdbMulti", "cached", "error", "open", "__version__"]
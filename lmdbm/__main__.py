@@ -0,0 +1,78 @@
+from argparse import ArgumentParser
+from typing import Optional, Type
+
+from .lmdbm import Lmdb, LmdbMulti
+from .transfer import BATCH_SIZE, SOURCES, dump, load, migrate, read_header
+
+CLASSES = ("Lmdb", "LmdbMulti", "LmdbArray")
+
+
+def get_class(name: str) -> Type[Lmdb]:
+    if name == "Lmdb":
+        return Lmdb
+    elif name == "LmdbMulti":
+        return LmdbMulti
+    elif name == "LmdbArray":
+        from .array import LmdbArray  # requires numpy
+
+        return LmdbArray
+    else:
+        raise ValueError(f"Invalid class: {name}")
+
+
+def get_class_by_dbname(dbname: Optional[str]) -> Type[Lmdb]:
+    for name in CLASSES:
+        cls = get_class(name)
+        if (None if cls.dbname is None else cls.dbname.decode("utf-8")) == dbname:
+            return cls
+    raise ValueError(f"Invalid database name: {dbname}")
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m lmdbm", description="Export, import and migrate lmdbm databases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_dump = subparsers.add_parser("dump", help="Export a database to a dump file")
+    parser_dump.add_argument("db", help="Path of the database")
+    parser_dump.add_argument("file", help="Path of the dump file")
+    parser_dump.add_argument("--compression", choices=("gzip", "bz2", "lzma"), help="Compress the dump file")
+    parser_dump.add_argument("--class", dest="cls", choices=CLASSES, default="Lmdb", help="Class of the database")
+
+    parser_load = subparsers.add_parser("load", help="Import a dump file into a database")
+    parser_load.add_argument("file", help="Path of the dump file. Compression is detected automatically.")
+    parser_load.add_argument("db", help="Path of the database. It is created if it doesn't exist.")
+    parser_load.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of entries per transaction")
+    parser_load.add_argument(
+        "--class", dest="cls", choices=CLASSES, help="Class of the database. Defaults to the class of the dump."
+    )
+
+    parser_migrate = subparsers.add_parser("migrate", help="Copy another dbm-style database into a database")
+    parser_migrate.add_argument("source", choices=sorted(SOURCES), help="Type of the source database")
+    parser_migrate.add_argument("path", help="Path of the source database")
+    parser_migrate.add_argument("db", help="Path of the database. It is created if it doesn't exist.")
+    parser_migrate.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of entries per transaction")
+    parser_migrate.add_argument("--class", dest="cls", choices=CLASSES, default="Lmdb", help="Class of the database")
+
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        with get_class(args.cls).open(args.db, "r") as db:
+            count = dump(db, args.file, args.compression)
+    elif args.command == "load":
+        if args.cls is None:
+            cls = get_class_by_dbname(read_header(args.file)["dbname"])
+        else:
+            cls = get_class(args.cls)
+        with cls.open(args.db, "c") as db:
+            count = load(db, args.file, args.batch_size)
+    elif args.command == "migrate":
+        with get_class(args.cls).open(args.db, "c") as db:
+            count = migrate(args.source, args.path, db, args.batch_size)
+    else:
+        assert False  # nosec
+
+    print(f"{args.command}: {count} entries")
+
+
+if __name__ == "__main__":
+    main()
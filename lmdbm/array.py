@@ -0,0 +1,146 @@
+import json
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import lmdb
+import numpy as np
+from numpy.lib.format import descr_to_dtype, dtype_to_descr
+
+from .lmdbm import KT, Lmdb, error
+
+
+class LmdbArray(Lmdb):
+    """Stores numpy arrays of a fixed dtype and shape as raw buffers.
+    The dtype and shape are stored once per database. If they are not given when the database is created,
+    they are taken from the first value which is stored.
+    """
+
+    dbname = b"array"
+    metaname = b"array-meta"
+
+    def __init__(self, env: lmdb.Environment, autogrow: bool) -> None:
+        Lmdb.__init__(self, env, autogrow)
+        self.db = self._open_db(self.dbname)
+        self.meta_db = self._open_db(self.metaname)
+        self.dtype: Optional[np.dtype] = None
+        self.shape: Optional[Tuple[int, ...]] = None
+
+        with self.env.begin(db=self.meta_db) as txn:
+            meta = txn.get(b"meta")
+        if meta is not None:
+            obj = json.loads(meta.decode("utf-8"))
+            self.dtype = descr_to_dtype(obj["descr"])
+            self.shape = tuple(obj["shape"])
+
+    @classmethod
+    def open(
+        cls,
+        file: str,
+        flag: str = "r",
+        mode: int = 0o755,
+        dtype: Optional[np.dtype] = None,
+        shape: Optional[Sequence[int]] = None,
+        **kwargs,
+    ) -> "LmdbArray":
+        """
+        Opens the database `file`. See `Lmdb.open` for the other arguments.
+        `dtype`, `shape`: Dtype and shape of the stored arrays. Must match the existing ones if given.
+        """
+
+        db = super().open(file, flag, mode, **kwargs)
+        if dtype is not None:
+            try:
+                db.set_layout(dtype, () if shape is None else shape)
+            except BaseException:
+                db.close()
+                raise
+        return db
+
+    def set_layout(self, dtype: np.dtype, shape: Sequence[int]) -> None:
+        """Sets the dtype and shape of the stored arrays. Raises `error` if they differ from the existing ones."""
+
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+
+        if dtype.hasobject:
+            raise ValueError("Object arrays cannot be stored as raw buffers")
+
+        if self.dtype is not None:
+            if (self.dtype, self.shape) != (dtype, shape):
+                raise error(f"Database stores {self.dtype} arrays of shape {self.shape}, not {dtype} of shape {shape}")
+            return
+
+        meta = json.dumps({"descr": dtype_to_descr(dtype), "shape": shape}).encode("utf-8")
+        self._write(lambda txn: txn.put(b"meta", meta, db=self.meta_db))
+        self.dtype = dtype
+        self.shape = shape
+
+    def _dump_meta(self) -> Dict[str, Any]:
+        if self.dtype is None:
+            return {}
+        return {"descr": dtype_to_descr(self.dtype), "shape": self.shape}
+
+    def _load_meta(self, meta: Dict[str, Any]) -> None:
+        if meta:
+            self.set_layout(descr_to_dtype(meta["descr"]), meta["shape"])
+
+    def _pre_value(self, value: np.ndarray) -> memoryview:
+        if self.dtype is None:
+            value = np.asarray(value)
+            self.set_layout(value.dtype, value.shape)
+        else:
+            value = np.asarray(value, dtype=self.dtype)
+            if value.shape != self.shape:
+                raise ValueError(f"Expected array of shape {self.shape}, got {value.shape}")
+
+        return memoryview(np.ascontiguousarray(value).reshape(-1).view(np.uint8))
+
+    def _post_value(self, value: bytes) -> np.ndarray:
+        # read-only view of `value` without copying
+        return np.frombuffer(value, dtype=self.dtype).reshape(self.shape)
+
+    def _layout(self) -> Tuple[np.dtype, Tuple[int, ...]]:
+        if self.dtype is None:
+            raise error("The dtype and shape of the database are not set yet")
+        return self.dtype, self.shape
+
+    def get_batch(self, keys: Sequence[KT], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns the arrays for `keys` stacked into a single array of shape `(len(keys), *shape)`.
+        All values are read in a single transaction and copied directly from the memory map into the result.
+        `out`: Optional preallocated C-contiguous output array. Raises KeyError if any key is missing.
+        """
+
+        dtype, shape = self._layout()
+
+        if out is None:
+            out = np.empty((len(keys),) + shape, dtype=dtype)
+        elif out.shape != (len(keys),) + shape or out.dtype != dtype or not out.flags.c_contiguous:
+            raise ValueError("`out` must be a C-contiguous array of matching dtype and shape")
+
+        # explicit row size, since -1 cannot be inferred for empty batches
+        rows = out.reshape(len(keys), int(np.prod(shape))).view(np.uint8)
+        with self.env.begin(db=self.db, buffers=True) as txn:
+            for i, key in enumerate(keys):
+                value = txn.get(self._pre_key(key))
+                if value is None:
+                    raise KeyError(key)
+                rows[i] = np.frombuffer(value, dtype=np.uint8)
+
+        return out
+
+    @contextmanager
+    def views(self, keys: Sequence[KT]) -> Iterator[List[np.ndarray]]:
+        """Yields read-only arrays for `keys` which point directly into the memory map without copying.
+        WARNING: The arrays are only valid until the context manager exits. Accessing them afterwards is undefined.
+        """
+
+        dtype, shape = self._layout()
+
+        with self.env.begin(db=self.db, buffers=True) as txn:
+            arrays = []
+            for key in keys:
+                value = txn.get(self._pre_key(key))
+                if value is None:
+                    raise KeyError(key)
+                arrays.append(np.frombuffer(value, dtype=dtype).reshape(shape))
+            yield arrays
@@ -0,0 +1,176 @@
+import atexit
+import os.path
+import pickle  # nosec
+from concurrent.futures import ThreadPoolExecutor
+from functools import update_wrapper
+from hashlib import blake2b
+from struct import Struct
+from threading import Lock
+from time import time
+from types import MethodType
+from typing import Any, Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
+
+from .lmdbm import Lmdb
+
+T = TypeVar("T")
+
+_uint32 = Struct(">I")
+_MISSING = object()
+
+# the same environment must not be opened more than once per process, so it is shared by all functions using it
+_dbs: Dict[str, Lmdb] = {}
+
+
+def _default_key(*args, **kwargs) -> bytes:
+    return pickle.dumps((args, sorted(kwargs.items())), protocol=4)
+
+
+class CachedFunction(Generic[T]):
+    """Wraps `func` and stores its results in a `Lmdb` database. See `cached`."""
+
+    def __init__(
+        self,
+        func: Callable[..., T],
+        db: Lmdb,
+        key: Callable[..., Union[bytes, str]] = _default_key,
+        codec: Any = pickle,
+        ttl: Optional[float] = None,
+        buffer_size: int = 1000,
+    ) -> None:
+        update_wrapper(self, func)
+        self.func = func
+        self.db = db
+        self.key = key
+        self.codec = codec
+        self.ttl = ttl
+        self.buffer_size = buffer_size
+        self._prefix = f"{func.__module__}.{func.__qualname__}".encode("utf-8")
+        # encoded results and their expiry times
+        self._buffer: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self._lock = Lock()
+
+    def _hash(self, args: tuple, kwargs: dict) -> bytes:
+        key = self.key(*args, **kwargs)
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        # the prefix is length-prefixed, so different splits of the same bytes into prefix and key don't collide
+        m = blake2b(_uint32.pack(len(self._prefix)), digest_size=16)
+        m.update(self._prefix)
+        m.update(key)
+        return m.digest()
+
+    def _encode(self, result: T) -> bytes:
+        value = self.codec.dumps(result)
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        return value
+
+    def _decode(self, value: Optional[bytes]) -> Any:
+        if value is None:
+            return _MISSING
+        return self.codec.loads(value)  # nosec
+
+    def _store(self, k: bytes, result: T) -> None:
+        value = self._encode(result)
+        expiry = None if self.ttl is None else time() + self.ttl
+        with self._lock:
+            self._buffer[k] = (value, expiry)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            # results expire using the TTL of the database, so expired results are removed by `sweep`
+            pairs = [(k, value) for k, (value, _expiry) in self._buffer.items()]
+            expiries = {k: expiry for k, (_value, expiry) in self._buffer.items() if expiry is not None}
+            self.db._put_many(pairs, expiries)
+            self._buffer = {}
+            if self.ttl is not None:
+                self.db.sweep()
+
+    def flush(self) -> None:
+        """Writes all buffered results to the database using a single transaction."""
+
+        with self._lock:
+            self._flush()
+
+    def _lookup(self, keys: List[bytes]) -> List[Any]:
+        now = time()
+        with self._lock:
+            buffered = [self._buffer.get(k) for k in keys]
+        # expired buffered results are looked up in the database as well, where they are expired too
+        values = [
+            None if entry is None or (entry[1] is not None and entry[1] < now) else entry[0] for entry in buffered
+        ]
+        missing = [k for k, value in zip(keys, values) if value is None]
+        stored = iter(self.db.get_many(missing))
+        return [self._decode(next(stored) if value is None else value) for value in values]
+
+    def __call__(self, *args, **kwargs) -> T:
+        k = self._hash(args, kwargs)
+        (result,) = self._lookup([k])
+        if result is _MISSING:
+            result = self.func(*args, **kwargs)
+            self._store(k, result)
+        return result
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        # bind the instance when used as a method. `flush` and the other attributes are still accessible.
+        if instance is None:
+            return self
+        return MethodType(self, instance)
+
+    def map(self, *iterables: Iterable, max_workers: Optional[int] = None) -> List[T]:
+        """Like the builtin `map`, but looks up all inputs using a single transaction
+        and computes only the missing results in parallel using a thread pool.
+        For methods, the instances must be passed as the first iterable.
+        """
+
+        argss: List[Tuple[Any, ...]] = list(zip(*iterables))
+        keys = [self._hash(args, {}) for args in argss]
+        results = self._lookup(keys)
+
+        misses = [i for i, result in enumerate(results) if result is _MISSING]
+        if misses:
+            with ThreadPoolExecutor(max_workers) as executor:
+                computed = executor.map(lambda i: self.func(*argss[i]), misses)
+                for i, result in zip(misses, computed):
+                    results[i] = result
+                    self._store(keys[i], result)
+
+        return results
+
+
+def cached(
+    path: str,
+    key: Callable[..., Union[bytes, str]] = _default_key,
+    codec: Any = pickle,
+    ttl: Optional[float] = None,
+    buffer_size: int = 1000,
+    **kwargs,
+) -> Callable[[Callable[..., T]], CachedFunction[T]]:
+    """Decorator which persistently memoizes the decorated function in the database `path`.
+    `key`: Converts the function arguments to bytes or str, which are hashed to 16 byte database keys.
+        Defaults to pickling the arguments. For methods the arguments include the instance.
+    `codec`: Object with `dumps` and `loads` methods to serialize the results. Defaults to `pickle`.
+    `ttl`: Results expire after `ttl` seconds. Defaults to no expiry. Expired results are removed from the database
+        whenever the buffer is flushed.
+    `buffer_size`: Number of results which are buffered before they are written in a single transaction.
+        The buffer is flushed when the interpreter exits, or by calling `.flush()`.
+    `**kwargs`: All other keyword arguments are passed through to `Lmdb.open` when the database is first opened.
+    """
+
+    def decorator(func: Callable[..., T]) -> CachedFunction[T]:
+        abspath = os.path.abspath(path)
+        try:
+            db = _dbs[abspath]
+        except KeyError:
+            db = _dbs[abspath] = Lmdb.open(path, "c", **kwargs)
+            atexit.register(db.close)
+
+        wrapper = CachedFunction(func, db, key, codec, ttl, buffer_size)
+        # registered after `db.close`, so it runs before it
+        atexit.register(wrapper.flush)
+        return wrapper
+
+    return decorator
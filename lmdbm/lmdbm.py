@@ -1,9 +1,16 @@
+import io
 import logging
+import os
 from collections.abc import Mapping, MutableMapping
 from gzip import compress, decompress
+from itertools import groupby, takewhile
+from operator import itemgetter
 from pathlib import Path
+from struct import Struct
 from sys import exit
-from typing import Any, Generic, Iterator, List, Optional, Tuple, TypeVar, Union
+from threading import Event, Thread
+from time import time
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
 
 import lmdb
 from typing_extensions import Self
@@ -16,11 +23,32 @@ logger = logging.getLogger(__name__)
 
 _DEFAULT = object()
 
+# names of internal sub-databases are stored as keys of the main database. keys with this prefix are reserved.
+_INTERNAL_PREFIX = b"\x01lmdbm-"
+_INDEX_PREFIX = b"ix-"
+_MAX_FIELD_SIZE = 511  # default maximum key size of lmdb
+
+_blob_manifest = Struct(">QQQ")  # size, chunk size, generation
+_blob_index = Struct(">QQ")  # generation, chunk index
+_expiry = Struct(">d")  # unix time. big-endian, so the byte order of non-negative values matches the numeric order
+_uint64 = Struct(">Q")
+_float64 = Struct(">d")
+
 
 class error(Exception):
     pass
 
 
+class _SubDbsMissing(Exception):
+    """Raised within write transactions to open sub-databases which were created by another handle.
+    `_write` calls `opener` outside of the aborted transaction and retries it.
+    """
+
+    def __init__(self, opener: Callable[[], None]) -> None:
+        Exception.__init__(self)
+        self.opener = opener
+
+
 class MissingOk:
     # for python < 3.8 compatibility
 
@@ -45,13 +73,384 @@ def remove_lmdbm(file: str, missing_ok: bool = True) -> None:
         base.rmdir()
 
 
+def _blob_chunk_key(key: bytes, generation: int, index: int) -> bytes:
+    # the suffix has a fixed size, so chunk keys of different keys cannot collide
+    return key + _blob_index.pack(generation, index)
+
+
+class BlobWriter(io.RawIOBase):
+    """Writes a value in chunks. Every `chunks_per_txn` chunks are committed in one transaction,
+    so memory usage and transaction size are bounded. The chunks are written under a new random generation
+    and the value replaces the previous one when the writer is closed. The chunks of the previous value are
+    deleted afterwards. If the writer is used as context manager and an exception occurs, the partially written
+    value is discarded and the previous value is kept. A writer which is garbage collected without being closed
+    is discarded as well.
+    """
+
+    def __init__(self, db: "Lmdb", key: bytes, chunk_size: int, chunks_per_txn: int) -> None:
+        io.RawIOBase.__init__(self)
+        self._db = db
+        self._key = key
+        self._chunk_size = chunk_size
+        self._chunks_per_txn = chunks_per_txn
+        self._buffer = bytearray()
+        self._pending: List[Tuple[bytes, bytes]] = []
+        self._index = 0
+        self._size = 0
+        self._generation = int.from_bytes(os.urandom(8), "big")
+        self._data_db = db._internal_db(b"blob-data")
+        self._meta_db = db._internal_db(b"blob-meta")
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size
+
+    def write(self, b) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+
+        b = memoryview(b).cast("B")
+        self._buffer += b
+        self._size += len(b)
+
+        offset = 0
+        while len(self._buffer) - offset >= self._chunk_size:
+            chunk = bytes(self._buffer[offset : offset + self._chunk_size])
+            self._pending.append((_blob_chunk_key(self._key, self._generation, self._index), chunk))
+            self._index += 1
+            offset += self._chunk_size
+            if len(self._pending) >= self._chunks_per_txn:
+                self._flush_chunks()
+        del self._buffer[:offset]
+
+        return len(b)
+
+    def _flush_chunks(self) -> None:
+        pending = self._pending
+
+        def func(txn: lmdb.Transaction) -> None:
+            with txn.cursor(db=self._data_db) as curs:
+                curs.putmulti(pending)
+
+        if pending:
+            self._db._write(func)
+            self._pending = []
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        if self._buffer:
+            self._pending.append((_blob_chunk_key(self._key, self._generation, self._index), bytes(self._buffer)))
+            self._buffer = bytearray()
+        self._flush_chunks()
+
+        manifest = _blob_manifest.pack(self._size, self._chunk_size, self._generation)
+
+        def func(txn: lmdb.Transaction) -> Optional[bytes]:
+            return txn.replace(self._key, manifest, db=self._meta_db)
+
+        old = self._db._write(func)
+        io.RawIOBase.close(self)
+        if old is not None:
+            _size, _chunk_size, generation = _blob_manifest.unpack(old)
+            self._db._delete_blob_chunks(self._key, generation)
+
+    def abort(self) -> None:
+        """Discards the value written so far and closes the writer."""
+
+        if self.closed:
+            return
+
+        self._buffer = bytearray()
+        self._pending = []
+        io.RawIOBase.close(self)
+        self._db._delete_blob_chunks(self._key, self._generation)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __del__(self) -> None:
+        # `IOBase.__del__` would call `close` and publish the incomplete value
+        try:
+            self.abort()
+        except lmdb.Error:  # the environment was already closed
+            pass
+
+
+class BlobReader(io.RawIOBase):
+    """Reads a value which was written by `BlobWriter` lazily. Each read uses its own read transaction."""
+
+    def __init__(self, db: "Lmdb", key: bytes, size: int, chunk_size: int, generation: int) -> None:
+        io.RawIOBase.__init__(self)
+        self._db = db
+        self._key = key
+        self._chunk_size = chunk_size
+        self._generation = generation
+        self._pos = 0
+        self._data_db = db._internal_db(b"blob-data")
+        self.size = size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence")
+
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return pos
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError("read from closed file")
+
+        b = memoryview(b).cast("B")
+        n = 0
+        with self._db.env.begin(db=self._data_db, buffers=True) as txn:
+            while n < len(b) and self._pos < self.size:
+                index, offset = divmod(self._pos, self._chunk_size)
+                chunk = txn.get(_blob_chunk_key(self._key, self._generation, index))
+                if chunk is None:
+                    # the value was replaced or deleted since the reader was opened
+                    raise error(f"Chunk {index} of blob {self._key!r} is missing")
+                part = chunk[offset : offset + len(b) - n]
+                if not part:
+                    raise error(f"Chunk {index} of blob {self._key!r} is truncated")
+                b[n : n + len(part)] = part
+                n += len(part)
+                self._pos += len(part)
+
+        return n
+
+    def readall(self) -> bytes:
+        buf = bytearray(max(self.size - self._pos, 0))
+        n = self.readinto(buf)
+        del buf[n:]
+        return bytes(buf)
+
+
+def _encode_field(value: Any) -> Optional[bytes]:
+    """Encodes index field values to bytes whose byte order matches the order of the values.
+    Numbers are compared as floats, so int and float fields can be mixed. str and bytes are compared bytewise.
+    """
+
+    if value is None:
+        return None
+    elif isinstance(value, bytes):
+        return value
+    elif isinstance(value, str):
+        return value.encode("utf-8")
+    elif isinstance(value, (int, float)):
+        # -0.0 equals 0, but has the sign bit set
+        if value == 0:
+            value = 0.0
+        # flip the sign bit of positive values and all bits of negative values
+        (bits,) = _uint64.unpack(_float64.pack(value))
+        return _uint64.pack(bits ^ 0xFFFFFFFFFFFFFFFF if bits & 2**63 else bits | 2**63)
+
+    raise TypeError(value)
+
+
+def _index_key(field: Optional[bytes]) -> Optional[bytes]:
+    """Truncates encoded fields to the maximum key size of the index. The prefix keeps the order,
+    but fields which are equal after truncation have to be compared using the full field.
+    Empty fields are not indexed, since LMDB doesn't support empty keys.
+    """
+
+    if not field:
+        return None
+    return field[:_MAX_FIELD_SIZE]
+
+
+class Index:
+    """Secondary index which maps the values returned by `extractor` to the keys of a `Lmdb` database.
+    It's updated within the same write transactions as the database.
+    """
+
+    def __init__(self, db: "Lmdb", name: str, extractor: Callable[[Any], Any], ixdb: lmdb._Database) -> None:
+        self.db = db
+        self.name = name
+        self.extractor = extractor
+        self.ixdb = ixdb
+
+    def _iter(self, txn: lmdb.Transaction, it: Iterator[Tuple[bytes, bytes]]) -> Iterator[bytes]:
+        if self.db._ttl_dbs is None:
+            return (k for _field, k in it)
+        now = time()
+        return (k for _field, k in it if not self.db._expired(txn, k, now))
+
+    def _field(self, txn: lmdb.Transaction, k: bytes) -> bytes:
+        """Returns the full encoded field of the entry `k`."""
+
+        db = self.db._main_db if self.db.db is None else self.db.db
+        return _encode_field(self.extractor(self.db._post_value(txn.get(k, db=db))))
+
+    def get(self, value: Any) -> List[Any]:
+        """Returns the keys whose field equals `value`."""
+
+        field = _encode_field(value)
+        ix_key = _index_key(field)
+        if ix_key is None:
+            return []
+        with self.db.env.begin(db=self.ixdb) as txn:
+            curs = txn.cursor()
+            if not curs.set_key(ix_key):
+                return []
+            it = curs.iternext_dup(keys=True, values=True)
+            if ix_key != field:
+                it = ((ix_field, k) for ix_field, k in it if self._field(txn, k) == field)
+            return [self.db._post_key(k) for k in self._iter(txn, it)]
+
+    def range(self, lo: Any = None, hi: Any = None) -> Iterator[Any]:
+        """Yields the keys whose field is in the half-open range `[lo, hi)`, ordered by field.
+        `None` means unbounded. str and bytes fields which are longer than 511 bytes are only ordered by their prefix.
+        """
+
+        lo_field = _encode_field(lo)
+        hi_field = _encode_field(hi)
+        lo_key = _index_key(lo_field)
+        hi_key = _index_key(hi_field)
+        if hi_field == b"":
+            return
+
+        def in_range(txn: lmdb.Transaction, ix_field: bytes, k: bytes) -> bool:
+            # only possibly truncated fields which equal a bound need to be compared using the full field
+            if len(ix_field) < _MAX_FIELD_SIZE or (ix_field != lo_key and ix_field != hi_key):
+                return True
+            field = self._field(txn, k)
+            return (lo_field is None or lo_field <= field) and (hi_field is None or field < hi_field)
+
+        with self.db.env.begin(db=self.ixdb) as txn:
+            curs = txn.cursor()
+            if lo_key is None:
+                found = curs.first()
+            else:
+                found = curs.set_range(lo_key)
+            if not found:
+                return
+
+            it = curs.iternext(keys=True, values=True)
+            if hi_key is not None:
+                if hi_key == hi_field:
+                    it = takewhile(lambda item: item[0] < hi_key, it)
+                else:
+                    # truncated fields which equal the truncated bound can still be smaller than it
+                    it = takewhile(lambda item: item[0] <= hi_key, it)
+            it = (item for item in it if in_range(txn, *item))
+            for k in self._iter(txn, it):
+                yield self.db._post_key(k)
+
+    def rebuild(self, batch_size: int = 10000) -> None:
+        """Rebuilds the index from all entries of the database.
+        The entries are read and the index is cleared in a single write transaction, and the index is written
+        in append mode using one transaction per `batch_size` entries. Queries during the rebuild see a partial index.
+        If writes of other handles interfere with the rebuild, the index is marked stale again and `error` is raised.
+        """
+
+        if self.db._stale_db is None:
+            self.db._open_stale_db()
+        stale_db = self.db._stale_db
+        name_b = self.name.encode("utf-8")
+        entries: List[Tuple[bytes, bytes]] = []
+
+        def put(txn: lmdb.Transaction, batch: List[Tuple[bytes, bytes]]) -> bool:
+            with txn.cursor(db=self.ixdb) as curs:
+                _consumed, added = curs.putmulti(batch, dupdata=True, append=True)
+            if added != len(batch):
+                # entries which other handles added in between sort after the batch
+                txn.put(name_b, b"", db=stale_db)
+                return False
+            return True
+
+        def start(txn: lmdb.Transaction) -> bool:
+            # reading and clearing within the same transaction, so no writes are lost in between.
+            # the stale marker is cleared as well, so writes of other handles during the rebuild mark it again.
+            entries.clear()
+            for k, value in self.db._iter_items(txn):
+                field = _index_key(_encode_field(self.extractor(self.db._post_value(value))))
+                if field is not None:
+                    entries.append((field, k))
+            entries.sort()
+            txn.delete(name_b, db=stale_db)
+            txn.drop(self.ixdb, delete=False)
+            return put(txn, entries[:batch_size])
+
+        ok = self.db._write(start)
+        for i in range(batch_size, len(entries), batch_size):
+            if not ok:
+                break
+            batch = entries[i : i + batch_size]
+            ok = self.db._write(lambda txn: put(txn, batch))
+
+        if not ok:
+            raise error(f"Index {self.name} was modified during the rebuild")
+
+
+class Sweeper(Thread):
+    """Background thread which calls `Lmdb.sweep` every `interval` seconds until it's stopped."""
+
+    def __init__(self, db: "Lmdb", interval: float, batch_size: int) -> None:
+        Thread.__init__(self, name="lmdbm-sweeper", daemon=True)
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop_event = Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.db.sweep(self.batch_size)
+            except Exception:
+                logger.exception("Sweeping expired keys of %s failed", self.db.env.path())
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
 class Lmdb(MutableMapping, Generic[KT, VT]):
     autogrow_error = "Failed to grow LMDB ({}). Is there enough disk space available?"
     autogrow_msg = "Grew database (%s) map size to %s"
+    max_dbs = 32
+    blob_chunk_size = 2**20
+    blob_chunks_per_txn = 16
+    dbname: Optional[bytes] = None  # name of the sub-database which stores the entries. None means the main database.
 
     def __init__(self, env: lmdb.Environment, autogrow: bool) -> None:
         self.env = env
         self.autogrow = autogrow
+        self.db: Optional[lmdb._Database] = None
+        self._internal_dbs: Dict[bytes, lmdb._Database] = {}
+        self._sweeper: Optional[Sweeper] = None
+        self._indexes: Dict[str, Index] = {}
+        self._stale_db: Optional[lmdb._Database] = None
+
+        self._main_db = env.open_db()
+
+        # reads only need to check for expired keys if TTLs were used before.
+        # writes check again in every transaction, since another handle could have started to use TTLs.
+        self._ttl_dbs: Optional[Tuple[lmdb._Database, lmdb._Database]] = None
+        self._refresh_ttl_dbs()
 
     @classmethod
     def open(
@@ -68,14 +467,22 @@ class Lmdb(MutableMapping, Generic[KT, VT]):
         """
 
         if flag == "r":  # Open existing database for reading only (default)
-            env = lmdb.open(file, map_size=map_size, max_dbs=1, readonly=True, create=False, mode=mode, **kwargs)
+            env = lmdb.open(
+                file, map_size=map_size, max_dbs=cls.max_dbs, readonly=True, create=False, mode=mode, **kwargs
+            )
         elif flag == "w":  # Open existing database for reading and writing
-            env = lmdb.open(file, map_size=map_size, max_dbs=1, readonly=False, create=False, mode=mode, **kwargs)
+            env = lmdb.open(
+                file, map_size=map_size, max_dbs=cls.max_dbs, readonly=False, create=False, mode=mode, **kwargs
+            )
         elif flag == "c":  # Open database for reading and writing, creating it if it doesn't exist
-            env = lmdb.open(file, map_size=map_size, max_dbs=1, readonly=False, create=True, mode=mode, **kwargs)
+            env = lmdb.open(
+                file, map_size=map_size, max_dbs=cls.max_dbs, readonly=False, create=True, mode=mode, **kwargs
+            )
         elif flag == "n":  # Always create a new, empty database, open for reading and writing
             remove_lmdbm(file)
-            env = lmdb.open(file, map_size=map_size, max_dbs=1, readonly=False, create=True, mode=mode, **kwargs)
+            env = lmdb.open(
+                file, map_size=map_size, max_dbs=cls.max_dbs, readonly=False, create=True, mode=mode, **kwargs
+            )
         else:
             raise ValueError("Invalid flag")
 
@@ -89,6 +496,178 @@ class Lmdb(MutableMapping, Generic[KT, VT]):
     def map_size(self, value: int) -> None:
         self.env.set_mapsize(value)
 
+    def _open_db(self, name: bytes, **kwargs) -> lmdb._Database:
+        """Opens the named sub-database `name`. It is created if the environment is writable.
+        `**kwargs`: Flags which are passed through to `lmdb.Environment.open_db`.
+        """
+
+        if self.env.flags()["readonly"]:
+            return self.env.open_db(name, create=False, **kwargs)
+        return self._write(lambda txn: self.env.open_db(name, txn=txn, **kwargs))
+
+    def _internal_db(self, name: bytes, **kwargs) -> lmdb._Database:
+        """Opens the internal sub-database `name` once and caches it."""
+
+        try:
+            return self._internal_dbs[name]
+        except KeyError:
+            db = self._internal_dbs[name] = self._open_db(_INTERNAL_PREFIX + name, **kwargs)
+            return db
+
+    def _open_ttl_dbs(self) -> Tuple[lmdb._Database, lmdb._Database]:
+        # `ttl-keys` maps keys to their expiry time, `ttl-index` contains `expiry time + key` ordered by time
+        return self._internal_db(b"ttl-keys"), self._internal_db(b"ttl-index")
+
+    def _refresh_ttl_dbs(self) -> None:
+        if self._ttl_dbs is None:
+            with self.env.begin() as txn:
+                has_ttl = txn.get(_INTERNAL_PREFIX + b"ttl-keys", db=self._main_db) is not None
+            if has_ttl:
+                self._ttl_dbs = self._open_ttl_dbs()
+
+    def _check_ttl_dbs(self, txn: lmdb.Transaction) -> None:
+        """Raises `_SubDbsMissing` if the TTL databases exist but are not open yet. It's handled by `_write`."""
+
+        if self._ttl_dbs is None and txn.get(_INTERNAL_PREFIX + b"ttl-keys", db=self._main_db) is not None:
+            raise _SubDbsMissing(self._refresh_ttl_dbs)
+
+    def _get_expiry(self, txn: lmdb.Transaction, k: bytes) -> Optional[float]:
+        if self._ttl_dbs is None:
+            return None
+        expiry = txn.get(k, db=self._ttl_dbs[0])
+        if expiry is None:
+            return None
+        return _expiry.unpack(expiry)[0]
+
+    def _expired(self, txn: lmdb.Transaction, k: bytes, now: float) -> bool:
+        expiry = self._get_expiry(txn, k)
+        return expiry is not None and expiry <= now
+
+    def _set_expiry(self, txn: lmdb.Transaction, k: bytes, expiry: Optional[float]) -> None:
+        """Sets the expiry time of `k` within the write transaction `txn`. `None` removes it."""
+
+        self._check_ttl_dbs(txn)
+        if self._ttl_dbs is None:
+            if expiry is None:
+                return
+            raise RuntimeError("TTL databases are not open")
+
+        keys_db, index_db = self._ttl_dbs
+        old = txn.get(k, db=keys_db)
+        if old is not None:
+            txn.delete(old + k, db=index_db)
+        if expiry is None:
+            if old is not None:
+                txn.delete(k, db=keys_db)
+        else:
+            e = _expiry.pack(expiry)
+            txn.put(k, e, db=keys_db)
+            txn.put(e + k, b"", db=index_db)
+
+    def _iter_keys(self, txn: lmdb.Transaction) -> Iterator[bytes]:
+        it = txn.cursor().iternext(keys=True, values=False)
+        if self.db is None:
+            # slicing instead of `startswith`, so it works for transactions using `buffers=True` as well
+            n = len(_INTERNAL_PREFIX)
+            it = (key for key in it if key[:n] != _INTERNAL_PREFIX)
+        if self._ttl_dbs is not None:
+            now = time()
+            it = (key for key in it if not self._expired(txn, key, now))
+        return it
+
+    def _iter_items(self, txn: lmdb.Transaction) -> Iterator[Tuple[bytes, bytes]]:
+        it = txn.cursor().iternext(keys=True, values=True)
+        if self.db is None:
+            n = len(_INTERNAL_PREFIX)
+            it = ((key, value) for key, value in it if key[:n] != _INTERNAL_PREFIX)
+        if self._ttl_dbs is not None:
+            now = time()
+            it = ((key, value) for key, value in it if not self._expired(txn, key, now))
+        return it
+
+    def _index_fields(self, v: bytes) -> List[Optional[bytes]]:
+        # always extract from the decoded stored value, so indexing, unindexing and rebuilding agree
+        # even if the encoding doesn't round-trip
+        value = self._post_value(v)
+        return [_index_key(_encode_field(index.extractor(value))) for index in self._indexes.values()]
+
+    def _unindex(self, txn: lmdb.Transaction, k: bytes, old: Optional[bytes]) -> None:
+        """Removes the index entries of `k` with the stored value `old` within the write transaction `txn`."""
+
+        if old is None:
+            return
+        for index, field in zip(self._indexes.values(), self._index_fields(old)):
+            if field is not None:
+                txn.delete(field, k, db=index.ixdb)
+
+    def _index(self, txn: lmdb.Transaction, k: bytes, fields: List[Optional[bytes]]) -> None:
+        for index, field in zip(self._indexes.values(), fields):
+            if field is not None:
+                txn.put(field, k, dupdata=True, db=index.ixdb)
+
+    def add_index(self, name: str, extractor: Callable[[VT], Any], rebuild: bool = False) -> Index:
+        """Registers the secondary index `name`, which is kept up to date by all following writes.
+        Indexes are persistent, but the extractor must be registered again every time the database is opened.
+        `extractor`: Returns the field of a value which is indexed. Can be str, bytes, int, float or None,
+            which is not indexed. Empty str and bytes fields are not indexed either. str and bytes fields
+            longer than 511 bytes are stored truncated and compared using the full field where necessary.
+        `rebuild`: Rebuild the index from all entries. Indexes which don't exist yet are always built.
+            Indexes which were marked stale by writes of handles without the extractor registered are rebuilt as well.
+            Raises `error` if the index needs to be built, but the database is read-only.
+        """
+
+        name_b = name.encode("utf-8")
+        with self.env.begin() as txn:
+            exists = txn.get(_INTERNAL_PREFIX + _INDEX_PREFIX + name_b, db=self._main_db) is not None
+            has_stale = txn.get(_INTERNAL_PREFIX + b"index-stale", db=self._main_db) is not None
+
+        stale = False
+        if has_stale:
+            self._open_stale_db()
+            with self.env.begin(db=self._stale_db) as txn:
+                stale = txn.get(name_b) is not None
+
+        if self.env.flags()["readonly"]:
+            if not exists:
+                raise error(f"Index {name} doesn't exist")
+            if stale:
+                raise error(f"Index {name} is stale. Open the database writable to rebuild it.")
+
+        index = Index(self, name, extractor, self._internal_db(_INDEX_PREFIX + name_b, dupsort=True))
+        self._indexes[name] = index
+        if rebuild or stale or not exists:
+            index.rebuild()
+        return index
+
+    def _open_stale_db(self) -> None:
+        # contains the names of indexes which were not updated by some writes
+        self._stale_db = self._internal_db(b"index-stale")
+
+    def _mark_stale_indexes(self, txn: lmdb.Transaction) -> None:
+        """Marks all persisted indexes which are not registered in this handle as stale within the write transaction
+        `txn`, since they are not updated by it. Stale indexes are rebuilt when they are registered again.
+        """
+
+        prefix = _INTERNAL_PREFIX + _INDEX_PREFIX
+        curs = txn.cursor(db=self._main_db)
+        if not curs.set_range(prefix):
+            return
+
+        for key in curs.iternext(keys=True, values=False):
+            if not key.startswith(prefix):
+                break
+            name_b = key[len(prefix) :]
+            if name_b.decode("utf-8") in self._indexes:
+                continue
+            if self._stale_db is None:
+                raise _SubDbsMissing(self._open_stale_db)
+            txn.put(name_b, b"", db=self._stale_db)
+
+    def index(self, name: str) -> Index:
+        """Returns the registered index `name`."""
+
+        return self._indexes[name]
+
     def _pre_key(self, key: KT) -> bytes:
         if isinstance(key, bytes):
             return key
@@ -112,20 +691,24 @@ class Lmdb(MutableMapping, Generic[KT, VT]):
         return value
 
     def __getitem__(self, key: KT) -> VT:
-        with self.env.begin() as txn:
-            value = txn.get(self._pre_key(key))
+        k = self._pre_key(key)
+        with self.env.begin(db=self.db) as txn:
+            value = txn.get(k)
+            if value is not None and self._expired(txn, k, time()):
+                value = None
         if value is None:
             raise KeyError(key)
         return self._post_value(value)
 
-    def __setitem__(self, key: KT, value: VT) -> None:
-        k = self._pre_key(key)
-        v = self._pre_value(value)
+    def _write(self, func: Callable[[lmdb.Transaction], T]) -> T:
+        """Runs `func` in a write transaction and retries it with a larger map size if the database is full."""
+
         for _i in range(12):
             try:
-                with self.env.begin(write=True) as txn:
-                    txn.put(k, v)
-                    return
+                with self.env.begin(write=True, db=self.db) as txn:
+                    return func(txn)
+            except _SubDbsMissing as e:
+                e.opener()
             except lmdb.MapFullError:
                 if not self.autogrow:
                     raise
@@ -135,41 +718,195 @@ class Lmdb(MutableMapping, Generic[KT, VT]):
 
         exit(self.autogrow_error.format(self.env.path()))
 
+    def __setitem__(self, key: KT, value: VT) -> None:
+        k = self._pre_key(key)
+        v = self._pre_value(value)
+        self._put(k, v, self._index_fields(v) if self._indexes else [], None)
+
+    def _put(self, k: bytes, v: bytes, fields: List[Optional[bytes]], expiry: Optional[float]) -> None:
+        def func(txn: lmdb.Transaction) -> None:
+            self._mark_stale_indexes(txn)
+            if self._indexes:
+                self._unindex(txn, k, txn.get(k))
+            txn.put(k, v)
+            self._index(txn, k, fields)
+            self._set_expiry(txn, k, expiry)
+
+        self._write(func)
+
     def __delitem__(self, key: KT) -> None:
-        with self.env.begin(write=True) as txn:
-            txn.delete(self._pre_key(key))
+        k = self._pre_key(key)
+
+        def func(txn: lmdb.Transaction) -> None:
+            self._mark_stale_indexes(txn)
+            if self._indexes:
+                self._unindex(txn, k, txn.get(k))
+            txn.delete(k)
+            self._set_expiry(txn, k, None)
+
+        self._write(func)
+
+    def set(self, key: KT, value: VT, ttl: Optional[float] = None) -> None:
+        """Sets `key` to `value`. If `ttl` is given, the key expires after `ttl` seconds.
+        Expired keys are treated as missing and are removed by `sweep`.
+        """
+
+        if ttl is None:
+            self[key] = value
+            return
+
+        k = self._pre_key(key)
+        v = self._pre_value(value)
+        expiry = time() + ttl
+        if self._ttl_dbs is None:
+            self._ttl_dbs = self._open_ttl_dbs()
+
+        self._put(k, v, self._index_fields(v) if self._indexes else [], expiry)
+
+    def expire(self, key: KT, ttl: Optional[float]) -> None:
+        """Sets the TTL of the existing `key` to `ttl` seconds. `None` removes the TTL."""
+
+        k = self._pre_key(key)
+        expiry = None if ttl is None else time() + ttl
+        if self._ttl_dbs is None and expiry is not None:
+            self._ttl_dbs = self._open_ttl_dbs()
+
+        def func(txn: lmdb.Transaction) -> bool:
+            if txn.get(k) is None or self._expired(txn, k, time()):
+                return False
+            self._set_expiry(txn, k, expiry)
+            return True
+
+        if not self._write(func):
+            raise KeyError(key)
+
+    def ttl(self, key: KT) -> Optional[float]:
+        """Returns the remaining TTL of `key` in seconds, or `None` if it doesn't expire."""
+
+        k = self._pre_key(key)
+        self._refresh_ttl_dbs()
+        with self.env.begin(db=self.db) as txn:
+            if txn.get(k) is None:
+                raise KeyError(key)
+            expiry = self._get_expiry(txn, k)
+        if expiry is None:
+            return None
+        remaining = expiry - time()
+        if remaining <= 0:
+            raise KeyError(key)
+        return remaining
+
+    def sweep(self, batch_size: int = 1000) -> int:
+        """Deletes expired keys using one write transaction per `batch_size` keys and returns their number.
+        The keys are found using an index ordered by expiry time, so the cost only depends on the number of expired keys.
+        """
+
+        self._refresh_ttl_dbs()
+        if self._ttl_dbs is None:
+            return 0
+
+        keys_db, index_db = self._ttl_dbs
+        now = time()
+
+        def func(txn: lmdb.Transaction) -> int:
+            self._mark_stale_indexes(txn)
+            curs = txn.cursor(db=index_db)
+            curs.first()
+            deleted = 0
+            # zero-length keys cannot exist, so an empty key means the end of the index was reached
+            while deleted < batch_size and curs.key():
+                entry = curs.key()
+                if _expiry.unpack_from(entry)[0] > now:
+                    break
+                k = entry[_expiry.size :]
+                if self._indexes:
+                    self._unindex(txn, k, txn.get(k))
+                txn.delete(k)
+                txn.delete(k, db=keys_db)
+                curs.delete()
+                deleted += 1
+            return deleted
+
+        total = 0
+        while True:
+            deleted = self._write(func)
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+    def start_sweeper(self, interval: float = 60.0, batch_size: int = 1000) -> Sweeper:
+        """Starts a background thread which calls `sweep` every `interval` seconds. It is stopped by `close`."""
+
+        if self._sweeper is not None:
+            raise error("Sweeper is already running")
+        self._sweeper = Sweeper(self, interval, batch_size)
+        self._sweeper.start()
+        return self._sweeper
 
     def keys(self) -> Iterator[KT]:
-        with self.env.begin() as txn:
-            for key in txn.cursor().iternext(keys=True, values=False):
+        with self.env.begin(db=self.db) as txn:
+            for key in self._iter_keys(txn):
                 yield self._post_key(key)
 
     def items(self) -> Iterator[Tuple[KT, VT]]:
-        with self.env.begin() as txn:
-            for key, value in txn.cursor().iternext(keys=True, values=True):
+        with self.env.begin(db=self.db) as txn:
+            for key, value in self._iter_items(txn):
                 yield (self._post_key(key), self._post_value(value))
 
     def values(self) -> Iterator[VT]:
-        with self.env.begin() as txn:
-            for value in txn.cursor().iternext(keys=False, values=True):
+        with self.env.begin(db=self.db) as txn:
+            for _key, value in self._iter_items(txn):
                 yield self._post_value(value)
 
+    def get_many(self, keys: Iterable[KT], default: Optional[T] = None) -> List[Union[VT, T]]:
+        """Returns the values for all `keys` using a single transaction. Missing keys are returned as `default`."""
+
+        now = time()
+        with self.env.begin(db=self.db) as txn:
+            values = []
+            for key in keys:
+                k = self._pre_key(key)
+                value = txn.get(k)
+                values.append(None if value is None or self._expired(txn, k, now) else value)
+        return [default if value is None else self._post_value(value) for value in values]
+
     def __contains__(self, key: KT) -> bool:
-        with self.env.begin() as txn:
-            value = txn.get(self._pre_key(key))
-        return value is not None
+        k = self._pre_key(key)
+        with self.env.begin(db=self.db) as txn:
+            return txn.get(k) is not None and not self._expired(txn, k, time())
 
     def __iter__(self) -> Iterator[KT]:
         return self.keys()
 
     def __len__(self) -> int:
-        with self.env.begin() as txn:
-            return txn.stat()["entries"]
+        # note: includes expired keys which were not swept yet
+        with self.env.begin(db=self.db) as txn:
+            entries = txn.stat()["entries"]
+            if self.db is None:
+                curs = txn.cursor()
+                if curs.set_range(_INTERNAL_PREFIX):
+                    entries -= sum(
+                        1 for key in curs.iternext(keys=True, values=False) if key.startswith(_INTERNAL_PREFIX)
+                    )
+            return entries
 
     def pop(self, key: KT, default: Union[VT, T] = _DEFAULT) -> Union[VT, T]:
-        with self.env.begin(write=True) as txn:
-            value = txn.pop(self._pre_key(key))
+        k = self._pre_key(key)
+
+        def func(txn: lmdb.Transaction) -> Optional[bytes]:
+            self._mark_stale_indexes(txn)
+            value = txn.pop(k)
+            if self._indexes:
+                self._unindex(txn, k, value)
+            if value is not None and self._expired(txn, k, time()):
+                value = None
+            self._set_expiry(txn, k, None)
+            return value
+
+        value = self._write(func)
         if value is None:
+            if default is _DEFAULT:
+                raise KeyError(key)
             return default
         return self._post_value(value)
 
@@ -181,51 +918,138 @@ class Lmdb(MutableMapping, Generic[KT, VT]):
         # lists: Finished 14412594 in 253496 seconds.
         # iter:  Finished 14412594 in 256315 seconds.
 
-        # save generated lists in case the insert fails and needs to be retried
-        # for performance reasons, but mostly because `__other` could be an iterable
-        # which would already be exhausted on the second try
-        pairs_other: Optional[List[Tuple[bytes, bytes]]] = None
-        pairs_kwds: Optional[List[Tuple[bytes, bytes]]] = None
+        # generate the lists before the transaction is started, so they can be reused in case the insert fails
+        # and needs to be retried. `__other` could be an iterable which would already be exhausted on the second try.
+        # also `_pre_value` of subclasses may need to write to the database itself.
+        if isinstance(__other, Mapping):
+            items = [(key, __other[key]) for key in __other]
+        elif hasattr(__other, "keys"):
+            items = [(key, __other[key]) for key in __other.keys()]
+        else:
+            items = list(__other)
+        items.extend(kwds.items())
+
+        pairs = [(self._pre_key(key), self._pre_value(value)) for key, value in items]
+        self._put_many(pairs)
 
-        for _i in range(12):
+    def _put_many(
+        self,
+        pairs: List[Tuple[bytes, bytes]],
+        expiries: Optional[Dict[bytes, float]] = None,
+        dupdata: bool = False,
+        append: bool = False,
+    ) -> int:
+        """Writes the encoded `pairs` using a single transaction and updates the indexes.
+        Returns the number of added pairs.
+        `expiries`: Expiry times of the keys. Other keys don't expire.
+        `dupdata`: Add the values to the existing ones of `dupsort` databases.
+        `append`: Use append mode if the keys are unique, sorted and sort after all existing keys,
+            which is checked within the transaction. Otherwise the pairs are inserted normally.
+        """
+
+        # later pairs replace earlier ones for the same key
+        fields = {k: self._index_fields(v) for k, v in pairs} if self._indexes else {}
+        append = append and all(a[0] < b[0] for a, b in zip(pairs, pairs[1:]))
+        if expiries and self._ttl_dbs is None:
+            self._ttl_dbs = self._open_ttl_dbs()
+
+        def func(txn: lmdb.Transaction) -> int:
+            self._mark_stale_indexes(txn)
+            if self._indexes:
+                for k in fields:
+                    self._unindex(txn, k, txn.get(k))
+            with txn.cursor() as curs:
+                # the database can contain keys which were not counted by `len`, like internal records
+                use_append = append and bool(pairs) and (not curs.last() or curs.key() < pairs[0][0])
+                _consumed, added = curs.putmulti(pairs, dupdata=dupdata, append=use_append)
+            if use_append and added != len(pairs):
+                raise error("Append mode failed")  # aborts the transaction
+            for k, f in fields.items():
+                self._index(txn, k, f)
+            self._check_ttl_dbs(txn)
+            if self._ttl_dbs is not None:
+                for k, _v in pairs:
+                    self._set_expiry(txn, k, expiries.get(k) if expiries else None)
+            return added
+
+        return self._write(func)
+
+    def open_blob(self, key: KT, mode: str = "rb", chunk_size: Optional[int] = None) -> io.RawIOBase:
+        """
+        Opens the large value `key` as file-like object. The value is stored in chunks,
+        so it never has to be held in memory completely. Blobs are separate from the normal mapping values.
+        `mode`: rb (read, supports `readinto` and seeking), wb (write, replaces the existing value on close)
+        `chunk_size`: Size of the stored chunks in bytes when writing. Defaults to `blob_chunk_size`.
+        """
+
+        k = self._pre_key(key)
+
+        if mode == "rb":
             try:
-                with self.env.begin(write=True) as txn:
-                    with txn.cursor() as curs:
-                        if isinstance(__other, Mapping):
-                            pairs_other = pairs_other or [
-                                (self._pre_key(key), self._pre_value(__other[key])) for key in __other
-                            ]
-                            curs.putmulti(pairs_other)
-                        elif hasattr(__other, "keys"):
-                            pairs_other = pairs_other or [
-                                (self._pre_key(key), self._pre_value(__other[key])) for key in __other.keys()
-                            ]
-                            curs.putmulti(pairs_other)
-                        else:
-                            pairs_other = pairs_other or [
-                                (self._pre_key(key), self._pre_value(value)) for key, value in __other
-                            ]
-                            curs.putmulti(pairs_other)
-
-                        pairs_kwds = pairs_kwds or [
-                            (self._pre_key(key), self._pre_value(value)) for key, value in kwds.items()
-                        ]
-                        curs.putmulti(pairs_kwds)
-
-                        return
-            except lmdb.MapFullError:
-                if not self.autogrow:
-                    raise
-                new_map_size = self.map_size * 2
-                self.map_size = new_map_size
-                logger.info(self.autogrow_msg, self.env.path(), new_map_size)
+                meta_db = self._internal_db(b"blob-meta")
+            except lmdb.NotFoundError:
+                raise KeyError(key) from None
+            with self.env.begin(db=meta_db) as txn:
+                manifest = txn.get(k)
+            if manifest is None:
+                raise KeyError(key)
+            size, stored_chunk_size, generation = _blob_manifest.unpack(manifest)
+            return BlobReader(self, k, size, stored_chunk_size, generation)
+        elif mode == "wb":
+            return BlobWriter(self, k, chunk_size or self.blob_chunk_size, self.blob_chunks_per_txn)
+        else:
+            raise ValueError("Invalid mode")
 
-        exit(self.autogrow_error.format(self.env.path()))
+    def delete_blob(self, key: KT) -> None:
+        """Deletes the large value `key`. Raises KeyError if it doesn't exist."""
+
+        if not self._delete_blob(self._pre_key(key)):
+            raise KeyError(key)
+
+    def _delete_blob(self, k: bytes) -> bool:
+        meta_db = self._internal_db(b"blob-meta")
+
+        # remove the manifest first, so readers cannot see a partially deleted value
+        manifest = self._write(lambda txn: txn.pop(k, db=meta_db))
+        if manifest is None:
+            return False
+
+        _size, _chunk_size, generation = _blob_manifest.unpack(manifest)
+        self._delete_blob_chunks(k, generation)
+        return True
+
+    def _delete_blob_chunks(self, k: bytes, generation: int) -> None:
+        data_db = self._internal_db(b"blob-data")
+
+        # chunks are numbered consecutively, so delete until the first missing one
+        start = 0
+
+        def func(txn: lmdb.Transaction) -> bool:
+            for i in range(start, start + self.blob_chunks_per_txn):
+                if not txn.delete(_blob_chunk_key(k, generation, i), db=data_db):
+                    return True
+            return False
+
+        while not self._write(func):
+            start += self.blob_chunks_per_txn
+
+    def _dump_meta(self) -> Dict[str, Any]:
+        """Returns the JSON serializable metadata which is needed to load the stored values into another database."""
+
+        return {}
+
+    def _load_meta(self, meta: Dict[str, Any]) -> None:
+        """Applies the metadata returned by `_dump_meta` of another database."""
+
+        pass
 
     def sync(self) -> None:
         self.env.sync()
 
     def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.stop()
+            self._sweeper = None
         self.env.close()
 
     def __enter__(self) -> Self:
@@ -248,5 +1072,156 @@ class LmdbGzip(Lmdb):
         return decompress(value)
 
 
+class LmdbMulti(Lmdb):
+    """Maps each key to a sorted set of values using a LMDB `dupsort` database.
+    Adding or removing a single value does not read or rewrite the other values of the key.
+    Note: encoded values are limited to the maximum key size of LMDB (511 bytes by default).
+    Expiring keys and secondary indexes are not supported.
+    """
+
+    dbname = b"multi"
+
+    def __init__(self, env: lmdb.Environment, autogrow: bool) -> None:
+        Lmdb.__init__(self, env, autogrow)
+        self.db = self._open_db(self.dbname, dupsort=True)
+
+    def set(self, key: KT, values: Iterable[VT], ttl: Optional[float] = None) -> None:
+        """Replaces all values of `key` with `values`. Raises `error` if `ttl` is given."""
+
+        if ttl is not None:
+            raise error("LmdbMulti doesn't support expiring keys")
+        self[key] = values
+
+    def expire(self, key: KT, ttl: Optional[float]) -> None:
+        """Not supported. Always raises `error`."""
+
+        raise error("LmdbMulti doesn't support expiring keys")
+
+    def add_index(self, name: str, extractor: Callable[[VT], Any], rebuild: bool = False) -> Index:
+        """Not supported. Always raises `error`."""
+
+        raise error("LmdbMulti doesn't support secondary indexes")
+
+    def add(self, key: KT, value: VT) -> None:
+        """Adds `value` to the values of `key`. Adding an existing value is a no-op."""
+
+        k = self._pre_key(key)
+        v = self._pre_value(value)
+        self._write(lambda txn: txn.put(k, v, dupdata=True))
+
+    def add_many(self, pairs: Iterable[Tuple[KT, VT]]) -> None:
+        """Adds all `(key, value)` pairs using a single transaction."""
+
+        items = [(self._pre_key(key), self._pre_value(value)) for key, value in pairs]
+
+        def func(txn: lmdb.Transaction) -> None:
+            with txn.cursor() as curs:
+                curs.putmulti(items, dupdata=True)
+
+        self._write(func)
+
+    def remove(self, key: KT, value: VT) -> None:
+        """Removes `value` from the values of `key`. Raises KeyError if the pair doesn't exist."""
+
+        k = self._pre_key(key)
+        v = self._pre_value(value)
+        if not self._write(lambda txn: txn.delete(k, v)):
+            raise KeyError((key, value))
+
+    def get_all(self, key: KT) -> List[VT]:
+        """Returns the sorted values of `key`. Returns an empty list if `key` doesn't exist."""
+
+        with self.env.begin(db=self.db) as txn:
+            curs = txn.cursor()
+            if not curs.set_key(self._pre_key(key)):
+                return []
+            return [self._post_value(value) for value in curs.iternext_dup()]
+
+    def get_many(self, keys: Iterable[KT], default: Optional[T] = None) -> List[Union[List[VT], T]]:
+        with self.env.begin(db=self.db) as txn:
+            curs = txn.cursor()
+            values = [list(curs.iternext_dup()) if curs.set_key(self._pre_key(key)) else None for key in keys]
+        return [default if v is None else [self._post_value(value) for value in v] for v in values]
+
+    def count(self, key: KT) -> int:
+        """Returns the number of values of `key`."""
+
+        with self.env.begin(db=self.db) as txn:
+            curs = txn.cursor()
+            if not curs.set_key(self._pre_key(key)):
+                return 0
+            return curs.count()
+
+    def __getitem__(self, key: KT) -> List[VT]:
+        values = self.get_all(key)
+        if not values:
+            raise KeyError(key)
+        return values
+
+    def __setitem__(self, key: KT, values: Iterable[VT]) -> None:
+        """Replaces all values of `key` with `values`."""
+
+        self.update([(key, values)])
+
+    def keys(self) -> Iterator[KT]:
+        with self.env.begin(db=self.db) as txn:
+            for key in txn.cursor().iternext_nodup(keys=True, values=False):
+                yield self._post_key(key)
+
+    def items(self) -> Iterator[Tuple[KT, List[VT]]]:
+        with self.env.begin(db=self.db) as txn:
+            for key, group in groupby(txn.cursor().iternext(keys=True, values=True), key=itemgetter(0)):
+                yield (self._post_key(key), [self._post_value(value) for _key, value in group])
+
+    def values(self) -> Iterator[List[VT]]:
+        for _key, values in self.items():
+            yield values
+
+    def __len__(self) -> int:
+        # `entries` counts every value, so the distinct keys have to be counted
+        with self.env.begin(db=self.db) as txn:
+            return sum(1 for _key in txn.cursor().iternext_nodup(keys=True, values=False))
+
+    def pop(self, key: KT, default: Union[List[VT], T] = _DEFAULT) -> Union[List[VT], T]:
+        k = self._pre_key(key)
+
+        def func(txn: lmdb.Transaction) -> Optional[List[bytes]]:
+            curs = txn.cursor()
+            if not curs.set_key(k):
+                return None
+            values = list(curs.iternext_dup())
+            txn.delete(k)
+            return values
+
+        values = self._write(func)
+        if values is None:
+            if default is _DEFAULT:
+                raise KeyError(key)
+            return default
+        return [self._post_value(value) for value in values]
+
+    def update(self, __other: Any = (), **kwds: Iterable[VT]) -> None:
+        """Replaces the values of all given keys using a single transaction."""
+
+        if isinstance(__other, Mapping):
+            pairs = [(key, __other[key]) for key in __other]
+        elif hasattr(__other, "keys"):
+            pairs = [(key, __other[key]) for key in __other.keys()]
+        else:
+            pairs = list(__other)
+        pairs.extend(kwds.items())
+
+        # later pairs replace earlier ones for the same key
+        encoded = {self._pre_key(key): [self._pre_value(value) for value in values] for key, values in pairs}
+
+        def func(txn: lmdb.Transaction) -> None:
+            with txn.cursor() as curs:
+                for k in encoded:
+                    txn.delete(k)
+                curs.putmulti([(k, v) for k, values in encoded.items() for v in values], dupdata=True)
+
+        self._write(func)
+
+
 def open(file, flag="r", mode=0o755, **kwargs):
     return Lmdb.open(file, flag, mode, **kwargs)
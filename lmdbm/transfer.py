@@ -0,0 +1,274 @@
+"""Export, import and migration of databases using a compact length-prefixed streaming format.
+
+The format consists of a magic number, a JSON header of `header length (uint32), header` and records of
+`key length (uint16), value length (uint32), expiry (float64), key, value`. An expiry of 0 means the key doesn't expire.
+The header stores the name of the sub-database of the dumped class and its metadata.
+All numbers are big-endian. The file can optionally be compressed as a whole using gzip, bz2 or lzma.
+"""
+
+import bz2
+import gzip
+import json
+import lzma
+from contextlib import ExitStack
+from itertools import islice
+from pathlib import Path
+from struct import Struct
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import lmdb
+
+from .lmdbm import Lmdb, error
+
+MAGIC = b"LMDBM-DUMP\x00\x01"
+_header = Struct(">I")
+_record = Struct(">HId")
+
+# sub-databases of the lmdbm classes, which cannot be dumped using a plain `Lmdb`
+_CLASSES = {
+    b"multi": "LmdbMulti",
+    b"array": "LmdbArray",
+}
+
+BUFFER_SIZE = 2**20
+BATCH_SIZE = 10000
+
+_compressors: Dict[str, Callable[..., IO[bytes]]] = {
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "lzma": lzma.open,
+}
+
+_compression_magic = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "lzma",
+}
+
+PathOrFile = Union[str, Path, IO[bytes]]
+
+
+def _open_write(stack: ExitStack, file: PathOrFile, compression: Optional[str]) -> IO[bytes]:
+    if compression is not None and compression not in _compressors:
+        raise ValueError(f"Invalid compression: {compression}")
+
+    if isinstance(file, (str, Path)):
+        fp = stack.enter_context(open(file, "wb", buffering=BUFFER_SIZE))
+    else:
+        fp = file
+
+    if compression is None:
+        return fp
+    return stack.enter_context(_compressors[compression](fp, "wb"))
+
+
+def _open_read(stack: ExitStack, file: PathOrFile) -> IO[bytes]:
+    if isinstance(file, (str, Path)):
+        fp = stack.enter_context(open(file, "rb", buffering=BUFFER_SIZE))
+    else:
+        fp = file
+
+    # compression can only be detected for files which support peeking
+    head = fp.peek(6)[:6] if hasattr(fp, "peek") else b""
+    for magic, compression in _compression_magic.items():
+        if head.startswith(magic):
+            return stack.enter_context(_compressors[compression](fp, "rb"))
+    return fp
+
+
+def _check_class(db: Lmdb) -> None:
+    """Raises `error` if `db` is a plain `Lmdb` whose main database stores the sub-database of another class."""
+
+    if db.dbname is not None:
+        return
+
+    with db.env.begin() as txn:
+        for dbname, classname in _CLASSES.items():
+            if txn.get(dbname) is None:
+                continue
+            try:
+                db.env.open_db(dbname, txn=txn, create=False)
+            except lmdb.IncompatibleError:
+                continue  # a normal key
+            raise error(
+                f"The database contains a {classname} database. Open it using {classname} (`--class {classname}`)."
+            )
+
+
+def dump(db: Lmdb, file: PathOrFile, compression: Optional[str] = None) -> int:
+    """Writes all entries of `db` including their expiry times to `file` and returns the number of entries.
+    The entries are written as stored, ie. without calling `_post_key` and `_post_value`, and in sorted order.
+    Blobs and indexes are not included.
+    `compression`: None, gzip, bz2 or lzma
+    """
+
+    _check_class(db)
+    db._refresh_ttl_dbs()
+    header = json.dumps(
+        {"dbname": None if db.dbname is None else db.dbname.decode("utf-8"), "meta": db._dump_meta()}
+    ).encode("utf-8")
+
+    count = 0
+    with ExitStack() as stack:
+        fp = _open_write(stack, file, compression)
+        fp.write(MAGIC)
+        fp.write(_header.pack(len(header)))
+        fp.write(header)
+        with db.env.begin(db=db.db, buffers=True) as txn:
+            for key, value in db._iter_items(txn):
+                expiry = db._get_expiry(txn, key)
+                fp.write(_record.pack(len(key), len(value), 0.0 if expiry is None else expiry))
+                fp.write(key)
+                fp.write(value)
+                count += 1
+
+    return count
+
+
+def _read_header(fp: IO[bytes]) -> Dict[str, Any]:
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise error("Not a lmdbm dump file")
+    size = fp.read(_header.size)
+    if len(size) != _header.size:
+        raise error("Truncated dump file")
+    (headerlen,) = _header.unpack(size)
+    header = fp.read(headerlen)
+    if len(header) != headerlen:
+        raise error("Truncated dump file")
+    return json.loads(header.decode("utf-8"))
+
+
+def read_header(file: PathOrFile) -> Dict[str, Any]:
+    """Returns the header of a dump created by `dump`. `dbname` is the name of the sub-database
+    of the dumped class or None for `Lmdb`. `meta` are the class specific metadata.
+    """
+
+    with ExitStack() as stack:
+        return _read_header(_open_read(stack, file))
+
+
+def _iter_records(fp: IO[bytes]) -> Iterator[Tuple[bytes, bytes, Optional[float]]]:
+    while True:
+        header = fp.read(_record.size)
+        if not header:
+            break
+        if len(header) != _record.size:
+            raise error("Truncated dump file")
+        keylen, valuelen, expiry = _record.unpack(header)
+        key = fp.read(keylen)
+        value = fp.read(valuelen)
+        if len(key) != keylen or len(value) != valuelen:
+            raise error("Truncated dump file")
+        yield key, value, expiry or None
+
+
+def iter_dump(file: PathOrFile) -> Iterator[Tuple[bytes, bytes, Optional[float]]]:
+    """Yields the `(key, value, expiry)` records of a dump created by `dump`. Compression is detected automatically.
+    `expiry` is the unix time when the key expires or None.
+    """
+
+    with ExitStack() as stack:
+        fp = _open_read(stack, file)
+        _read_header(fp)
+        yield from _iter_records(fp)
+
+
+def _load_records(
+    db: Lmdb, records: Iterable[Tuple[bytes, bytes, Optional[float]]], batch_size: int = BATCH_SIZE
+) -> int:
+    dupsort = False
+    if db.db is not None:
+        with db.env.begin() as txn:
+            dupsort = db.db.flags(txn)["dupsort"]
+    # append mode cannot be used for duplicate keys
+    append = not dupsort
+
+    it = iter(records)
+    count = 0
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            break
+
+        pairs = [(key, value) for key, value, _expiry in batch]
+        expiries = {key: expiry for key, _value, expiry in batch if expiry is not None}
+        # indexes and expiry times are updated in the same transactions
+        db._put_many(pairs, expiries, dupdata=dupsort, append=append)
+        count += len(batch)
+
+    return count
+
+
+def load_pairs(db: Lmdb, pairs: Iterable[Tuple[bytes, bytes]], batch_size: int = BATCH_SIZE) -> int:
+    """Writes the already encoded `(key, value)` pairs to `db` using one transaction per `batch_size` pairs
+    and returns the number of pairs. Batches of sorted keys which sort after all existing keys are inserted in
+    append mode, which is much faster. Registered indexes are updated. Indexes which are not registered
+    are marked stale and rebuilt when they are registered the next time.
+    """
+
+    return _load_records(db, ((key, value, None) for key, value in pairs), batch_size)
+
+
+def load(db: Lmdb, file: PathOrFile, batch_size: int = BATCH_SIZE) -> int:
+    """Loads a dump created by `dump` into `db` and returns the number of entries. Expiry times are restored.
+    Raises `error` if the dump was created from a database of a different class. See `load_pairs`.
+    """
+
+    with ExitStack() as stack:
+        fp = _open_read(stack, file)
+        header = _read_header(fp)
+        dbname = None if db.dbname is None else db.dbname.decode("utf-8")
+        if header["dbname"] != dbname:
+            raise error(
+                f"The dump was created from a different class (sub-database {header['dbname']!r}, not {dbname!r})"
+            )
+        db._load_meta(header["meta"])
+        return _load_records(db, _iter_records(fp), batch_size)
+
+
+def _read_dbm_dumb(path: str) -> Tuple[List[bytes], Callable[[bytes], bytes], Callable[[], None]]:
+    import dbm.dumb
+
+    db = dbm.dumb.open(path, "r")
+    return list(db.keys()), db.__getitem__, db.close
+
+
+def _read_semidbm(path: str) -> Tuple[List[bytes], Callable[[bytes], bytes], Callable[[], None]]:
+    import semidbm
+
+    db = semidbm.open(path, "r")
+    return list(db.keys()), db.__getitem__, db.close
+
+
+def _read_sqlitedict(path: str) -> Tuple[List[str], Callable[[str], bytes], Callable[[], None]]:
+    from sqlitedict import SqliteDict
+
+    # values are copied in their stored (pickled) form
+    db = SqliteDict(path, flag="r", decode=bytes)
+    return list(db.keys()), db.__getitem__, db.close
+
+
+SOURCES = {
+    "dbm.dumb": _read_dbm_dumb,
+    "semidbm": _read_semidbm,
+    "sqlitedict": _read_sqlitedict,
+}
+
+
+def migrate(source: str, path: str, db: Lmdb, batch_size: int = BATCH_SIZE) -> int:
+    """Copies all entries of the database `path` of type `source` to `db` and returns the number of entries.
+    The keys are encoded using `db._pre_key` and sorted first, so the values can be inserted in append mode.
+    `source`: dbm.dumb, semidbm or sqlitedict
+    """
+
+    try:
+        reader = SOURCES[source]
+    except KeyError:
+        raise ValueError(f"Invalid source: {source}") from None
+
+    keys, getitem, close = reader(path)
+    try:
+        encoded = sorted((db._pre_key(key), key) for key in keys)
+        return load_pairs(db, ((k, getitem(key)) for k, key in encoded), batch_size)
+    finally:
+        close()
@@ -0,0 +1,59 @@
+import numpy as np
+from genutility.test import MyTestCase
+
+from lmdbm import error
+from lmdbm.array import LmdbArray
+from lmdbm.lmdbm import remove_lmdbm
+
+
+class LmdbArrayTests(MyTestCase):
+    _name = "./test-array.db"
+
+    def tearDown(self):
+        remove_lmdbm(self._name)
+
+    def test_layout(self):
+        with LmdbArray.open(self._name, "n", map_size=1024) as db:
+            db[b"a"] = np.arange(4, dtype=np.float32)
+            self.assertEqual(db.dtype, np.float32)
+            self.assertEqual(db.shape, (4,))
+
+            with self.assertRaises(ValueError):
+                db[b"b"] = np.arange(3, dtype=np.float32)
+
+        with LmdbArray.open(self._name, "r") as db:
+            np.testing.assert_array_equal(db[b"a"], np.arange(4, dtype=np.float32))
+
+        with self.assertRaises(error):
+            LmdbArray.open(self._name, "w", dtype=np.int64, shape=(4,))
+
+    def test_get_batch(self):
+        dtype = np.dtype([("id", "<i8"), ("vec", "<f4", (3,))])
+        values = np.zeros((10, 2), dtype=dtype)
+        values["id"] = np.arange(20).reshape(10, 2)
+        values["vec"] = np.arange(60).reshape(10, 2, 3)
+
+        with LmdbArray.open(self._name, "n", dtype=dtype, shape=(2,)) as db:
+            db.update((str(i), value) for i, value in enumerate(values))
+
+            keys = ["3", "1", "7"]
+            np.testing.assert_array_equal(db.get_batch(keys), values[[3, 1, 7]])
+
+            out = np.empty((3, 2), dtype=dtype)
+            self.assertIs(db.get_batch(keys, out=out), out)
+            np.testing.assert_array_equal(out, values[[3, 1, 7]])
+
+            with db.views(keys) as arrays:
+                for array, value in zip(arrays, values[[3, 1, 7]]):
+                    np.testing.assert_array_equal(array, value)
+
+            with self.assertRaises(KeyError):
+                db.get_batch(["1", "missing"])
+
+            self.assertEqual(db.get_batch([]).shape, (0, 2))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
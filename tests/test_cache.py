@@ -0,0 +1,88 @@
+import shutil
+from tempfile import mkdtemp
+from time import sleep
+
+from genutility.test import MyTestCase
+
+from lmdbm import cached
+
+
+class CachedTests(MyTestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cached(self):
+        @cached(self.tempdir, buffer_size=2)
+        def square(x, offset=0):
+            self.calls.append(x)
+            return x * x + offset
+
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(2, offset=1), 5)
+        self.assertEqual(self.calls, [2, 2])
+        self.assertEqual(len(square.db), 2)
+
+        self.assertEqual(square.map(range(5)), [0, 1, 4, 9, 16])
+        self.assertUnorderedSeqEqual(self.calls, [2, 2, 0, 1, 3, 4])
+        square.flush()
+        self.assertEqual(len(square.db), 6)
+
+    def test_prefix(self):
+        @cached(self.tempdir, key=str)
+        def f(x):
+            return "f"
+
+        @cached(self.tempdir, key=str)
+        def foo(x):
+            return "foo"
+
+        # the function names and keys concatenate to the same bytes
+        self.assertEqual(foo(""), "foo")
+        foo.flush()
+        self.assertEqual(f("oo"), "f")
+
+    def test_method(self):
+        calls = self.calls
+
+        class A:
+            @cached(self.tempdir, key=lambda self, x: str(x))
+            def double(self, x):
+                calls.append(x)
+                return 2 * x
+
+        a = A()
+        self.assertEqual(a.double(1), 2)
+        self.assertEqual(a.double(1), 2)
+        self.assertEqual(calls, [1])
+        a.double.flush()
+
+    def test_ttl(self):
+        @cached(self.tempdir, key=str, ttl=0.05)
+        def identity(x):
+            self.calls.append(x)
+            return x
+
+        identity("a")
+        identity("a")
+        sleep(0.1)
+        identity("a")
+        self.assertEqual(self.calls, ["a", "a"])
+
+        # expired results are removed when flushing
+        identity.flush()
+        self.assertGreater(identity.db.ttl(identity._hash(("a",), {})), 0)
+        sleep(0.1)
+        identity("b")
+        identity.flush()
+        self.assertEqual(len(identity.db), 1)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -1,9 +1,13 @@
+import gc
+import io
+import json
 from pathlib import Path
+from time import sleep
 
 from genutility.test import MyTestCase
 from lmdb import Error
 
-from lmdbm import Lmdb
+from lmdbm import Lmdb, LmdbMulti, error
 from lmdbm.lmdbm import remove_lmdbm
 
 
@@ -60,6 +64,196 @@ class LmdbmTests(MyTestCase):
 
         assert not Path(self._name).exists()
 
+    def test_blob(self):
+        data = bytes(range(256)) * 40
+
+        with Lmdb.open(self._name, "n", map_size=1024) as db:
+            db[b"meta"] = b"value"
+            with db.open_blob(b"blob", "wb", chunk_size=1000) as fw:
+                fw.write(data[:1500])
+                fw.write(data[1500:])
+
+            with self.assertRaises(KeyError):
+                db.open_blob(b"aborted", "rb")
+            with self.assertRaises(RuntimeError):
+                with db.open_blob(b"aborted", "wb") as fw:
+                    fw.write(data)
+                    raise RuntimeError()
+            with self.assertRaises(KeyError):
+                db.open_blob(b"aborted", "rb")
+
+            fw = db.open_blob(b"unclosed", "wb")
+            fw.write(b"partial")
+            del fw
+            gc.collect()
+            with self.assertRaises(KeyError):
+                db.open_blob(b"unclosed", "rb")
+
+            self.assertEqual(list(db.keys()), [b"meta"])
+            self.assertEqual(len(db), 1)
+
+        with Lmdb.open(self._name, "r") as db:
+            with db.open_blob(b"blob") as fr:
+                buf = bytearray(1200)
+                self.assertEqual(fr.readinto(buf), 1200)
+                self.assertEqual(buf, data[:1200])
+                fr.seek(-100, io.SEEK_END)
+                self.assertEqual(fr.read(), data[-100:])
+                fr.seek(999)
+                self.assertEqual(fr.read(2), data[999:1001])
+                fr.seek(0)
+                self.assertEqual(fr.read(), data)
+
+        with Lmdb.open(self._name, "w") as db:
+            # the previous value is kept until a rewrite is closed
+            with self.assertRaises(RuntimeError):
+                with db.open_blob(b"blob", "wb") as fw:
+                    fw.write(b"new")
+                    raise RuntimeError()
+            with db.open_blob(b"blob") as fr:
+                self.assertEqual(fr.read(4), data[:4])
+                with db.open_blob(b"blob", "wb", chunk_size=2) as fw:
+                    fw.write(b"new")
+                with self.assertRaises(error):
+                    fr.read()
+            with db.open_blob(b"blob") as fr:
+                self.assertEqual(fr.read(), b"new")
+
+            db.delete_blob(b"blob")
+            with self.assertRaises(KeyError):
+                db.delete_blob(b"blob")
+
+        self._delete_db()
+
+    def test_ttl(self):
+        with Lmdb.open(self._name, "n", map_size=1024) as db:
+            db.set(b"a", b"1", ttl=0.05)
+            db.set(b"b", b"2", ttl=60)
+            db.set(b"c", b"3", ttl=0.05)
+            db[b"c"] = b"4"  # removes the TTL
+            db.set(b"d", b"5")
+            db.expire(b"d", 0.05)
+
+            self.assertEqual(db[b"a"], b"1")
+            self.assertIsNone(db.ttl(b"c"))
+            self.assertLessEqual(db.ttl(b"b"), 60)
+            sleep(0.1)
+
+            self.assertNotIn(b"a", db)
+            self.assertIsNone(db.get(b"d"))
+            self.assertEqual(db.get_many([b"a", b"b", b"c"]), [None, b"2", b"4"])
+            self.assertEqual(dict(db.items()), {b"b": b"2", b"c": b"4"})
+            with self.assertRaises(KeyError):
+                db.expire(b"a", 1)
+
+            self.assertEqual(len(db), 4)
+            self.assertEqual(db.sweep(batch_size=1), 2)
+            self.assertEqual(len(db), 2)
+            self.assertEqual(db.sweep(), 0)
+
+        with Lmdb.open(self._name, "r") as db:
+            self.assertEqual(list(db.keys()), [b"b", b"c"])
+            self.assertGreater(db.ttl(b"b"), 0)
+
+        self._delete_db()
+
+    def test_ttl_other_handle(self):
+        with Lmdb.open(self._name, "n") as a:
+            a[b"k"] = b"1"
+            # a second handle which starts using TTLs after the first one was opened
+            b = Lmdb(a.env, a.autogrow)
+            b.set(b"k", b"2", ttl=0.05)
+            a[b"k"] = b"permanent"
+            sleep(0.1)
+            self.assertEqual(a.sweep(), 0)
+            self.assertEqual(b[b"k"], b"permanent")
+
+        self._delete_db()
+
+    def test_index(self):
+        class JsonLmdb(Lmdb):
+            def _pre_value(self, value):
+                return json.dumps(value).encode("utf-8")
+
+            def _post_value(self, value):
+                return json.loads(value.decode("utf-8"))
+
+        with JsonLmdb.open(self._name, "n", map_size=1024) as db:
+            db[b"a"] = {"age": 30}
+            db[b"b"] = {"age": -5}
+            index = db.add_index("age", lambda value: value.get("age"))
+            self.assertEqual(list(index.range()), [b"b", b"a"])
+
+            db.update({b"c": {"age": 30}, b"d": {"age": 2.5}}, e={})
+            db[b"a"] = {"age": 40}
+            db.set(b"f", {"age": 1}, ttl=0.05)
+            self.assertEqual(db.pop(b"b"), {"age": -5})
+            self.assertEqual(list(db.index("age").range(0, 40)), [b"f", b"d", b"c"])
+            self.assertEqual(index.get(40), [b"a"])
+            db[b"z"] = {"age": -0.0}
+            self.assertEqual(index.get(0), [b"z"])
+            del db[b"z"]
+
+            sleep(0.1)
+            self.assertEqual(list(index.range(0)), [b"d", b"c", b"a"])
+            db.sweep()
+            del db[b"a"]
+            self.assertEqual(list(index.range(None, 40)), [b"d", b"c"])
+
+        with JsonLmdb.open(self._name, "w") as db:
+            index = db.add_index("age", lambda value: value.get("age"))
+            self.assertEqual(index.get(30), [b"c"])
+            index = db.add_index("age", lambda value: -value.get("age", 0), rebuild=True)
+            self.assertEqual(list(index.range()), [b"c", b"d", b"e"])
+
+        with Lmdb.open(self._name, "n") as db:
+            # str values are returned as bytes
+            index = db.add_index("value", lambda value: value)
+            db[b"k"] = "caf\xe9"
+            self.assertEqual(index.get(b"caf\xe9"), [b"k"])
+            del db[b"k"]
+            self.assertEqual(list(index.range()), [])
+
+            # fields longer than the maximum key size
+            long = "x" * 600
+            db.update({b"a": long + "a", b"b": long + "b", b"c": long})
+            self.assertEqual(index.get(long + "b"), [b"b"])
+            self.assertEqual(sorted(index.range(long, long + "b")), [b"a", b"c"])
+            self.assertEqual(list(index.range(long + "a")), [b"a", b"b"])
+            del db[b"a"]
+            self.assertEqual(index.get(long + "a"), [])
+
+            # empty fields are not indexed
+            db[b"e"] = b""
+            self.assertEqual(index.get(b""), [])
+            self.assertEqual(list(index.range(None, b"")), [])
+
+        self._delete_db()
+
+    def test_index_stale(self):
+        with Lmdb.open(self._name, "n") as db:
+            db.add_index("value", lambda value: value)
+            db[b"a"] = b"1"
+
+        with Lmdb.open(self._name, "w") as db:
+            # writes without the index registered
+            db[b"b"] = b"2"
+            del db[b"a"]
+
+        with Lmdb.open(self._name, "r") as db:
+            with self.assertRaises(error):
+                db.add_index("value", lambda value: value)
+
+        with Lmdb.open(self._name, "w") as db:
+            index = db.add_index("value", lambda value: value)
+            self.assertEqual(list(index.range()), [b"b"])
+            self.assertEqual(index.get(b"1"), [])
+            db[b"c"] = b"3"
+            index.rebuild(batch_size=1)
+            self.assertEqual(list(index.range()), [b"b", b"c"])
+
+        self._delete_db()
+
     def test_modify(self):
         self._init_db()
         with Lmdb.open(self._name, "c") as f:
@@ -72,6 +266,59 @@ class LmdbmTests(MyTestCase):
         self._delete_db()
 
 
+class LmdbMultiTests(MyTestCase):
+    _name = "./test-multi.db"
+
+    def tearDown(self):
+        remove_lmdbm(self._name)
+
+    def test_add_remove(self):
+        with LmdbMulti.open(self._name, "n", map_size=1024) as db:
+            db.add(b"a", b"2")
+            db.add(b"a", b"1")
+            db.add(b"a", b"1")
+            db.add_many([(b"a", b"3"), (b"b", b"1")])
+
+            self.assertEqual(db.get_all(b"a"), [b"1", b"2", b"3"])
+            self.assertEqual(db.count(b"a"), 3)
+            self.assertEqual(db.count(b"c"), 0)
+            self.assertEqual(db.get_all(b"c"), [])
+
+            db.remove(b"a", b"2")
+            self.assertEqual(db[b"a"], [b"1", b"3"])
+            with self.assertRaises(KeyError):
+                db.remove(b"a", b"2")
+
+            self.assertEqual(list(db.keys()), [b"a", b"b"])
+            self.assertEqual(len(db), 2)
+
+    def test_mapping(self):
+        with LmdbMulti.open(self._name, "n") as db:
+            db[b"a"] = [b"1", b"2"]
+            db[b"a"] = [b"3"]
+            db.update({b"b": [b"1"]}, c=[b"1", b"2"])
+            self.assertEqual(dict(db.items()), {b"a": [b"3"], b"b": [b"1"], b"c": [b"1", b"2"]})
+
+            self.assertEqual(db.pop(b"c"), [b"1", b"2"])
+            self.assertIsNone(db.pop(b"c", None))
+            del db[b"b"]
+            self.assertEqual(list(db.values()), [[b"3"]])
+
+        with LmdbMulti.open(self._name, "r") as db:
+            self.assertEqual(db[b"a"], [b"3"])
+
+    def test_unsupported(self):
+        with LmdbMulti.open(self._name, "n") as db:
+            db.set(b"a", [b"1"])
+            with self.assertRaises(error):
+                db.set(b"a", [b"1"], ttl=1)
+            with self.assertRaises(error):
+                db.expire(b"a", 1)
+            with self.assertRaises(error):
+                db.add_index("value", lambda value: value)
+            self.assertEqual(db[b"a"], [b"1"])
+
+
 if __name__ == "__main__":
     import unittest
 
@@ -0,0 +1,133 @@
+import dbm.dumb
+import io
+import os
+import shutil
+from tempfile import mkdtemp
+
+from genutility.test import MyTestCase
+
+from lmdbm import Lmdb, LmdbMulti, error
+from lmdbm.transfer import dump, load, migrate
+
+
+class TransferTests(MyTestCase):
+    _dict = {
+        b"a": b"Python:",
+        b"b": b"Programming",
+        b"c": b"",
+        b"d": b"way" * 1000,
+    }
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def test_dump_load(self):
+        with Lmdb.open(self._path("src.db"), "n") as db:
+            db.update(self._dict)
+            db.open_blob(b"blob", "wb").close()
+
+            for compression in (None, "gzip", "bz2", "lzma"):
+                with self.subTest(compression=compression):
+                    path = self._path(f"dump-{compression}")
+                    self.assertEqual(dump(db, path, compression), len(self._dict))
+
+                    with Lmdb.open(self._path(f"dst-{compression}.db"), "n", map_size=1024) as dst:
+                        self.assertEqual(load(dst, path, batch_size=3), len(self._dict))
+                        self.assertEqual(dict(dst.items()), self._dict)
+
+            fp = io.BytesIO()
+            dump(db, fp)
+            fp.seek(0)
+            with Lmdb.open(self._path("dst.db"), "n") as dst:
+                dst[b"e"] = b"existing"
+                load(dst, fp)
+                self.assertEqual(dict(dst.items()), {**self._dict, b"e": b"existing"})
+
+        with self.assertRaises(error):
+            with Lmdb.open(self._path("dst.db"), "n") as dst:
+                load(dst, io.BytesIO(b"invalid"))
+
+    def test_dump_load_multi(self):
+        with LmdbMulti.open(self._path("src.db"), "n") as db:
+            db.add_many([(b"a", b"1"), (b"a", b"2"), (b"b", b"1")])
+            path = self._path("dump")
+            dump(db, path)
+
+        with LmdbMulti.open(self._path("dst.db"), "n") as dst:
+            self.assertEqual(load(dst, path), 3)
+            self.assertEqual(dict(dst.items()), {b"a": [b"1", b"2"], b"b": [b"1"]})
+
+    def test_dump_load_ttl_index(self):
+        with Lmdb.open(self._path("src.db"), "n") as db:
+            db.update(self._dict)
+            db.set(b"e", b"expires", ttl=60)
+            path = self._path("dump")
+            self.assertEqual(dump(db, path), len(self._dict) + 1)
+
+        with Lmdb.open(self._path("dst.db"), "n") as dst:
+            index = dst.add_index("value", lambda value: value[:3] or None)
+            self.assertEqual(load(dst, path), len(self._dict) + 1)
+            self.assertGreater(dst.ttl(b"e"), 0)
+            self.assertIsNone(dst.ttl(b"a"))
+            self.assertEqual(index.get(b"way"), [b"d"])
+
+    def test_load_before_internal_records(self):
+        with Lmdb.open(self._path("src.db"), "n") as db:
+            db.set(b"\x00abc", b"x", ttl=60)
+            db[b"b"] = b"x"
+            path = self._path("dump")
+            dump(db, path)
+
+        with Lmdb.open(self._path("dst.db"), "n") as dst:
+            dst.add_index("value", lambda value: value)
+            self.assertEqual(load(dst, path), 2)
+            self.assertEqual(dict(dst.items()), {b"\x00abc": b"x", b"b": b"x"})
+            self.assertGreater(dst.ttl(b"\x00abc"), 0)
+
+    def test_class_mismatch(self):
+        with LmdbMulti.open(self._path("src.db"), "n") as db:
+            db.add(b"a", b"1")
+
+        with Lmdb.open(self._path("src.db"), "r") as db:
+            with self.assertRaises(error):
+                dump(db, self._path("dump"))
+
+        with LmdbMulti.open(self._path("src.db"), "r") as db:
+            dump(db, self._path("dump"))
+
+        with Lmdb.open(self._path("dst.db"), "n") as dst:
+            with self.assertRaises(error):
+                load(dst, self._path("dump"))
+
+    def test_migrate(self):
+        path = self._path("dumb")
+        with dbm.dumb.open(path, "n") as src:
+            for k, v in self._dict.items():
+                src[k] = v
+
+        with Lmdb.open(self._path("dst.db"), "n") as dst:
+            self.assertEqual(migrate("dbm.dumb", path, dst), len(self._dict))
+            self.assertEqual(dict(dst.items()), self._dict)
+
+    def test_migrate_str_keys(self):
+        from sqlitedict import SqliteDict
+
+        path = self._path("src.sqlite")
+        with SqliteDict(path, autocommit=True) as src:
+            src["caf\xe9"] = 1
+
+        with Lmdb.open(self._path("dst.db"), "n") as dst:
+            self.assertEqual(migrate("sqlitedict", path, dst), 1)
+            self.assertIn("caf\xe9", dst)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()